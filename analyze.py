@@ -1,18 +1,57 @@
 
+import argparse
 import json
 import glob
+import hashlib
 import os
+import pickle
 import re
 import time
 import sys
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
 from janome.tokenizer import Tokenizer
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Define paths
 transcript_pattern = "transcripts/*.txt.md"
 keywords_file = "keywords.json"
 output_dir = "docs"
-cache_file = "janome_cache.json"
+# トランスクリプトごとに1ファイルのキャッシュを置く (変更のあった分だけ書き直す)
+cache_dir = "janome_cache"
+# 以前の全ファイル分をまとめたキャッシュ。シャードが無いファイルの分だけ一度読み込んで移行する
+legacy_cache_file = "janome_cache.json"
+# キャッシュの形式や解析ロジックを変えたら番号を上げて再生成させる
+token_cache_version = 2
+parser_cache_version = 1
+
+# Keyword patterns (compiled once at import time)
+katakana_pattern = re.compile(r'[\u30A0-\u30FF\u30FC]{3,}')
+# 2語目以降は必ず半角スペースで始まるので、入れ子の量指定子でも破滅的なバックトラックは起きない
+english_pattern = re.compile(r'[a-zA-Z0-9]{3,}(?: [a-zA-Z0-9]+)*')
+# 1文字だけ・数字のみ・2文字以下の英数字のみ・2文字以下のひらがなのみのキーワードはノイズとして扱う
+noise_keyword_pattern = re.compile(r'.|[0-9]+|[A-Za-z0-9]{1,2}|[\u3041-\u309F]{1,2}')
+
+# 基本チャンク作成・キーワード収集で使う品詞の表 (ループ内で毎回作らないよう定数にしておく)
+modifier_chunk_pos = {
+    '形容詞': 'ADJP',
+    '形容動詞': 'ADJP',
+    '副詞': 'MOD',
+    '連体詞': 'MOD'
+}
+subject_particles = frozenset(['が', 'は'])
+reason_particles = frozenset(['ので', 'から'])
+keyword_phrase_pos = frozenset(['NP', 'VP', 'ADJP'])
 
 
 class ShiftReduceParser:
@@ -42,224 +81,289 @@ class ShiftReduceParser:
             # --- 節 (Clause) を生成するルール ---
             ('Clause', ['ADJP', 'P_reason', 'VP']), # Rule F (代表例)
         ]
+        # 右辺の末尾の記号でルールを索引化しておく。
+        # 同じバケット内ではルールの定義順(=優先度)を保つ。
+        self.rules_by_last = defaultdict(list)
+        for lhs, rhs in self.rules:
+            self.rules_by_last[rhs[-1]].append((lhs, tuple(rhs), len(rhs)))
         self.debug_mode = debug_mode
 
-    def _find_rule_match(self, stack):
+    def _find_rule_match(self, pos_stack):
         """
         スタックの末尾が、いずれかのルールの右辺にマッチするかどうかをチェックする。
+        pos_stack はスタックと同期して管理している品詞(pos)だけのリスト。
         マッチすれば、そのルールとマッチした長さを返す。
         """
-        for lhs, rhs in self.rules:
-            rhs_len = len(rhs)
-            if len(stack) >= rhs_len:
-                stack_end_pos = [chunk['pos'] for chunk in stack[-rhs_len:]]
-                if stack_end_pos == rhs:
-                    return (lhs, rhs), rhs_len
+        if not pos_stack:
+            return None, 0
+        stack_len = len(pos_stack)
+        for lhs, rhs, rhs_len in self.rules_by_last.get(pos_stack[-1], ()):
+            # 末尾は索引で一致済み。先頭の記号を先に比べ、外れたらタプルを作らずに次へ
+            if stack_len < rhs_len or pos_stack[-rhs_len] != rhs[0]:
+                continue
+            # 2要素のルールは先頭と末尾だけで一致が確定する
+            if rhs_len <= 2 or tuple(pos_stack[-rhs_len:]) == rhs:
+                return (lhs, rhs), rhs_len
         return None, 0
 
-    def parse(self, chunks):
+    def parse(self, chunks, collected_keywords=None):
         """
         シフトリデュース構文解析を実行する。
+        チャンクを左から1つずつシフトし、そのたびにスタック末尾をリデュースできなくなるまで縮約する。
+        各チャンクは1回だけシフトされるので、全体で入力長に比例した回数で終わる。
+        collected_keywords に集合を渡すと、シフト・リデュースの時点で
+        キーワード候補となる句の表層形をその集合に追加する。
         """
         stack = []
-        queue = list(chunks)
+        pos_stack = []
 
         if self.debug_mode:
             print(f"--- 解析開始 ---")
-            print(f"入力キュー: {[c['surface'] for c in queue]}")
-
-        while queue or len(stack) > 1:
-            reduced_in_pass = False
-            while True:
-                rule, rhs_len = self._find_rule_match(stack)
-                if rule:
-                    lhs, rhs = rule
-                    target_chunks = stack[-rhs_len:]
-                    combined_surface = "".join([c['surface'] for c in target_chunks])
-                    
-                    if self.debug_mode:
-                        print(f"リデュース実行: {' '.join([c['surface'] for c in target_chunks])}  ->  {lhs}('{combined_surface}')")
-
-                    stack = stack[:-rhs_len]
-                    new_chunk = {'pos': lhs, 'surface': combined_surface, 'from': rhs, 'children': target_chunks}
-                    stack.append(new_chunk)
-                    reduced_in_pass = True
-                else:
-                    break
-            
-            if queue:
-                chunk_to_shift = queue.pop(0)
-                if self.debug_mode:
-                    print(f"シフト: '{chunk_to_shift['surface']}' ({chunk_to_shift['pos']})")
-                stack.append(chunk_to_shift)
-            
-            elif not reduced_in_pass and len(stack) > 1:
-                if self.debug_mode:
-                    print(f"解析失敗: キューが空ですが、スタックを1つの句にリデュースできません。")
-                    print(f"最終スタック: {json.dumps(stack, indent=2, ensure_ascii=False)}")
-                return stack
+            print(f"入力キュー: {[c['surface'] for c in chunks]}")
+
+        for chunk_to_shift in chunks:
+            if self.debug_mode:
+                print(f"シフト: '{chunk_to_shift['surface']}' ({chunk_to_shift['pos']})")
+            stack.append(chunk_to_shift)
+            pos_stack.append(chunk_to_shift['pos'])
+            if collected_keywords is not None:
+                self._collect_keyword(chunk_to_shift, collected_keywords)
+
+            self._reduce(stack, pos_stack, collected_keywords)
+
+        if len(stack) > 1:
+            if self.debug_mode:
+                print(f"解析失敗: キューが空ですが、スタックを1つの句にリデュースできません。")
+                print(f"最終スタック: {json.dumps(stack, indent=2, ensure_ascii=False)}")
+            return stack
 
         if self.debug_mode:
             print(f"--- 解析完了 ---")
         return stack
 
-    def _collect_chunks_from_tree(self, root_chunk):
+    def _reduce(self, stack, pos_stack, collected_keywords):
         """
-        解析結果の木構造を再帰的に辿り、すべての中間生成物を含むチャンクをリストで返す。
+        スタック末尾がいずれかのルールにマッチする間、リデュースを繰り返す。
         """
-        if not root_chunk:
-            return []
-        
-        collected = [root_chunk]
-        if 'children' in root_chunk:
-            for child in root_chunk['children']:
-                collected.extend(self._collect_chunks_from_tree(child))
-        return collected
-
-    def _contains_noun(self, chunk):
-        if not chunk:
-            return False
-
-        # If it's a base chunk (from create_base_chunks), check its tokens
-        if 'tokens' in chunk:
-            for token in chunk['tokens']:
-                pos_major = token['part_of_speech'].split(',')[0]
-                if pos_major == '名詞':
-                    return True
-        
-        # If it's a combined chunk, recursively check its children
-        if 'children' in chunk:
-            for child in chunk['children']:
-                if self._contains_noun(child):
-                    return True
-        
-        return False
-
-# --- Caching Setup ---
-try:
-    with open(cache_file, 'r', encoding='utf-8') as f:
-        cache_data = json.load(f)
-except (FileNotFoundError, json.JSONDecodeError):
-    cache_data = {}
-
-# Ensure output directory exists
-os.makedirs(output_dir, exist_ok=True)
-
-print("Loading transcripts...")
-# Load transcripts, extract titles, and clean content
-transcript_files = glob.glob(transcript_pattern)
-transcripts_data = {}
-for filepath in transcript_files:
-    filename = os.path.basename(filepath)
-    with open(filepath, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        if not lines:
-            continue
+        while True:
+            rule, rhs_len = self._find_rule_match(pos_stack)
+            if not rule:
+                return
+            lhs, rhs = rule
+            target_chunks = stack[-rhs_len:]
+            # 現行ルールの右辺は2〜3要素なので、その場合は直接連結する
+            if rhs_len == 2:
+                combined_surface = target_chunks[0]['surface'] + target_chunks[1]['surface']
+            elif rhs_len == 3:
+                combined_surface = (target_chunks[0]['surface'] + target_chunks[1]['surface']
+                                    + target_chunks[2]['surface'])
+            else:
+                combined_surface = "".join([c['surface'] for c in target_chunks])
+
+            if self.debug_mode:
+                print(f"リデュース実行: {' '.join([c['surface'] for c in target_chunks])}  ->  {lhs}('{combined_surface}')")
+
+            del stack[-rhs_len:]
+            del pos_stack[-rhs_len:]
+            new_chunk = {
+                'pos': lhs,
+                'surface': combined_surface,
+                'has_noun': any(c['has_noun'] for c in target_chunks)
+            }
+            stack.append(new_chunk)
+            pos_stack.append(lhs)
+            if collected_keywords is not None:
+                self._collect_keyword(new_chunk, collected_keywords)
 
-        raw_title = lines[0].strip()
-        cleaned_title = raw_title.split(' - ')[0]
-        content = "".join(lines[1:]).strip()
-
-        transcripts_data[filename] = {
-            "title": cleaned_title,
-            "content": content,
-            "filepath": filepath
-        }
-print(f"Loaded {len(transcripts_data)} transcripts.")
-
-# --- Tokenization with Caching ---
-t = Tokenizer()
-all_tokens = {}
-needs_cache_update = False
-
-print("Tokenizing transcripts (using cache possible)...")
-for filename, data in transcripts_data.items():
-    filepath = data['filepath']
-    mtime = os.path.getmtime(filepath)
-    
-    if filename in cache_data and cache_data[filename].get('mtime') == mtime:
-        all_tokens[filename] = cache_data[filename]['tokens']
+    def _collect_keyword(self, chunk, collected_keywords):
+        """
+        意味のある句（NP, VP, ADJP）で3文字以上かつ名詞を含むものをキーワード候補として追加する。
+        """
+        if chunk['pos'] in keyword_phrase_pos and len(chunk['surface']) >= 3 and chunk['has_noun']:
+            collected_keywords.add(chunk['surface'])
+
+# --- Cache Helpers ---
+# キャッシュは pickle で保存する。intern 済みの品詞などの文字列は pickle の中で共有されるので、
+# JSON に比べてファイルが小さく、読み込みも速い (このスクリプト自身が書いたファイルだけを読む)
+def cache_path_for(filename):
+    return os.path.join(cache_dir, filename + '.pkl')
+
+def content_hash(content):
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+def load_cache_entry(filename):
+    """
+    キャッシュを読み込んで返す。キャッシュが無いか壊れている場合は None を返す。
+    """
+    try:
+        with open(cache_path_for(filename), 'rb') as f:
+            entry = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # 壊れた pickle は UnpicklingError 以外の例外も投げうるので、何であれキャッシュなしとして扱う
+        return None
+    return entry if isinstance(entry, dict) else None
+
+def save_cache_entry(filename, entry):
+    # 一時ファイルに書いてから置き換え、途中で中断されても壊れたキャッシュを残さない
+    path = cache_path_for(filename)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def load_legacy_cache():
+    """
+    以前の単一ファイルのキャッシュ (janome_cache.json) を読み込み、ファイル名→エントリの辞書を返す。
+    無いか壊れている場合は空の辞書を返す。
+    """
+    try:
+        with open(legacy_cache_file, 'r', encoding='utf-8') as f:
+            legacy_cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return legacy_cache if isinstance(legacy_cache, dict) else {}
+
+def convert_legacy_cache_entry(entry):
+    """
+    以前のキャッシュのエントリ ({'mtime', 'tokens': [{'surface', 'part_of_speech', 'infl_form'}]}) を
+    今のシャードの形式に変換する。変換できない場合は None を返す。
+    content_hash は持たないので、mtime が一致した場合だけ再利用される。
+    """
+    try:
+        tokens = []
+        for token in entry['tokens']:
+            pos_major, pos_minor = token['part_of_speech'].split(',', 2)[:2]
+            tokens.append({
+                'surface': sys.intern(token['surface']),
+                'pos_major': sys.intern(pos_major),
+                'pos_minor': sys.intern(pos_minor),
+                'infl_form': sys.intern(token['infl_form'])
+            })
+        return {'mtime': entry['mtime'], 'token_version': token_cache_version, 'tokens': tokens}
+    except (KeyError, TypeError, AttributeError, ValueError):
+        return None
+
+# --- Output ---
+def write_output_json(path, data, indent=True):
+    """
+    data を JSON で書き出す。既存のファイルと内容が同じなら書き込まず False を返す。
+    """
+    # orjson があれば使う (出力は json.dump(ensure_ascii=False, indent=2) と同じ形式)
+    # indent=False ならインデントも区切りの空白も入れずに詰めて書く
+    if orjson is not None:
+        encoded = orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0)
+    elif indent:
+        encoded = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
     else:
-        print(f"  - Analyzing: {filename}")
-        needs_cache_update = True
-        tokens = list(t.tokenize(data['content']))
-        
-        serializable_tokens = [
-            {'surface': token.surface, 'part_of_speech': token.part_of_speech, 'infl_form': token.infl_form}
-            for token in tokens
-        ]
-        
-        all_tokens[filename] = serializable_tokens
-        cache_data[filename] = {
-            'mtime': mtime,
-            'tokens': serializable_tokens
-        }
-
-if needs_cache_update:
-    print(f"Saving token cache to {cache_file}...")
-    with open(cache_file, 'w', encoding='utf-8') as f:
-        json.dump(cache_data, f, ensure_ascii=False)
+        encoded = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    # transcripts.json など大きな出力は前回から変わらないことが多いので、書き直しを省く
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == encoded:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, 'wb') as f:
+        f.write(encoded)
+    return True
+
+# --- Tokenization ---
+def serialize_tokens(tokenizer, content):
+    # Janome のトークンはジェネレータから1つずつ受け取り、Token オブジェクトのリストは作らない
+    serializable_tokens = []
+    for token in tokenizer.tokenize(content):
+        # 品詞の大分類・小分類はここで一度だけ分割して保存する
+        pos_major, pos_minor = token.part_of_speech.split(',', 2)[:2]
+        serializable_tokens.append({
+            'surface': sys.intern(token.surface),
+            'pos_major': sys.intern(pos_major),
+            'pos_minor': sys.intern(pos_minor),
+            'infl_form': sys.intern(token.infl_form)
+        })
+    return serializable_tokens
+
+_worker_tokenizer = None
+
+def tokenize_transcript(job):
+    """
+    (filename, content) を受け取り、(filename, serialized tokens) を返す。
+    Tokenizer は辞書の読み込みが重いので、プロセスごとに最初の呼び出しで一度だけ作る。
+    """
+    global _worker_tokenizer
+    if _worker_tokenizer is None:
+        _worker_tokenizer = Tokenizer()
+    filename, content = job
+    return filename, serialize_tokens(_worker_tokenizer, content)
+
+# --- Parallel Processing ---
+def map_in_processes(func, jobs):
+    """
+    ファイル単位の独立したジョブを、CPUコア数分のプロセスで並列に処理する。
+    ジョブが1件以下かCPUが1つの場合は、このプロセス内で順に処理する。結果の順序は保証しない。
+    """
+    worker_count = min(os.cpu_count() or 1, len(jobs))
+    if worker_count > 1:
+        with Pool(worker_count) as pool:
+            return list(pool.imap_unordered(func, jobs))
+    return [func(job) for job in jobs]
+
+# --- Transcript Loading ---
+def read_transcript_text(filepath):
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return filepath, f.read()
 
 def create_base_chunks(tokens):
+    num_tokens = len(tokens)
+    # 品詞の大分類は最初にリストにしておき、句の範囲を探すループではそれだけを見る
+    pos_majors = [token['pos_major'] for token in tokens]
     chunks = []
     i = 0
-    while i < len(tokens):
+    while i < num_tokens:
         token = tokens[i]
-        pos_major = token['part_of_speech'].split(',')[0]
-        pos_minor = token['part_of_speech'].split(',')[1]
+        pos_major = pos_majors[i]
+        pos_minor = token['pos_minor']
 
         # Rule 1: Noun Phrases (NP)
         if pos_major == '接頭詞' or pos_major == '名詞':
             j = i
-            chunk_tokens = []
-            while j < len(tokens):
-                current_pos_major = tokens[j]['part_of_speech'].split(',')[0]
+            while j < num_tokens:
+                current_pos_major = pos_majors[j]
                 if current_pos_major == '名詞' or current_pos_major == '接頭詞':
-                    chunk_tokens.append(tokens[j])
                     j += 1
                 else:
                     break
-            if chunk_tokens:
+            if j > i:
+                # 接頭詞だけで終わる句もあるので、名詞を含むかはここで判定しておく
                 chunks.append({
-                    'surface': "".join([t['surface'] for t in chunk_tokens]),
-                    'tokens': chunk_tokens,
-                    'pos': 'NP'
+                    'surface': "".join([t['surface'] for t in tokens[i:j]]),
+                    'pos': 'NP',
+                    'has_noun': '名詞' in pos_majors[i:j]
                 })
                 i = j
                 continue
 
         # Rule 2: Verb Phrases (VP)
         if pos_major == '動詞':
-            j = i
-            chunk_tokens = [tokens[j]]
-            j += 1
-            while j < len(tokens):
-                current_pos_major = tokens[j]['part_of_speech'].split(',')[0]
-                if current_pos_major == '助動詞':
-                    chunk_tokens.append(tokens[j])
-                    j += 1
-                else:
-                    break
+            j = i + 1
+            while j < num_tokens and pos_majors[j] == '助動詞':
+                j += 1
             chunks.append({
-                'surface': "".join([t['surface'] for t in chunk_tokens]),
-                'tokens': chunk_tokens,
-                'pos': 'VP'
+                'surface': "".join([t['surface'] for t in tokens[i:j]]),
+                'pos': 'VP',
+                'has_noun': False
             })
             i = j
             continue
 
         # Rule 3: Adjective Phrases (ADJP) & Modifiers (MOD)
-        if pos_major in ['形容詞', '形容動詞', '副詞', '連体詞']:
-            pos_map = {
-                '形容詞': 'ADJP',
-                '形容動詞': 'ADJP',
-                '副詞': 'MOD',
-                '連体詞': 'MOD'
-            }
+        if pos_major in modifier_chunk_pos:
             chunks.append({
                 'surface': token['surface'],
-                'tokens': [token],
-                'pos': pos_map.get(pos_major)
+                'pos': modifier_chunk_pos[pos_major],
+                'has_noun': False
             })
             i += 1
             continue
@@ -272,19 +376,19 @@ def create_base_chunks(tokens):
                 new_pos = 'P_attr'
             elif pos_minor == '格助詞' and surface == 'を':
                 new_pos = 'P_obj'
-            elif (pos_minor == '格助詞' or pos_minor == '係助詞') and surface in ['が', 'は']:
+            elif (pos_minor == '格助詞' or pos_minor == '係助詞') and surface in subject_particles:
                 new_pos = 'P_subj'
             elif pos_minor == '接続助詞':
                 new_pos = 'P_conn'
             elif pos_minor == '並立助詞':
                 new_pos = 'P_para'
-            elif surface in ['ので', 'から']:
+            elif surface in reason_particles:
                 new_pos = 'P_reason'
             
             chunks.append({
                 'surface': surface,
-                'tokens': [token],
-                'pos': new_pos
+                'pos': new_pos,
+                'has_noun': False
             })
             i += 1
             continue
@@ -292,47 +396,30 @@ def create_base_chunks(tokens):
         # Default Rule (その他)
         chunks.append({
             'surface': token['surface'],
-            'tokens': [token],
-            'pos': pos_major # その他の品詞はそのまま (例: '記号')
+            'pos': pos_major, # その他の品詞はそのまま (例: '記号')
+            'has_noun': False
         })
         i += 1
     return chunks
 
-
-
-# 1. Load keywords from JSON file
-json_keywords = set()
-try:
-    with open(keywords_file, 'r', encoding='utf-8') as f:
-        keywords_data = json.load(f)
-        for item in keywords_data.get('keywords', []):
-            json_keywords.add(item.get('keyword', ''))
-    print(f"Loaded {len(json_keywords)} keywords from '{keywords_file}'.")
-except (FileNotFoundError, json.JSONDecodeError):
-    print(f"Warning: Could not load or parse '{keywords_file}'. Continuing without it.")
-
-# 2. Extract Katakana & English keywords
-katakana_keywords = set()
-english_keywords = set()
-katakana_pattern = re.compile(r'[\u30A0-\u30FF\u30FC]{3,}')
-english_pattern = re.compile(r'[a-zA-Z0-9]{3,}(?: [a-zA-Z0-9]+)*')
-for data in transcripts_data.values():
-    katakana_keywords.update(katakana_pattern.findall(data['content']))
-    english_keywords.update(english_pattern.findall(data['content']))
-print(f"Extracted {len(katakana_keywords)} unique Katakana keywords.")
-print(f"Extracted {len(english_keywords)} unique English keywords.")
-
-# 3. Generate keywords from tokens using the new ShiftReduceParser
-print("Generating keywords using Shift-Reduce Parser...")
-
-file_counter = 0 # デバッグ用カウンタ
-
-generated_keywords_with_nouns = set()
-
-for filename, tokens in all_tokens.items():
-    debug_this_file = False # 最初の1ファイルだけデバッグモード
+def extract_pattern_keywords(content):
+    """
+    本文からカタカナ語と英単語のキーワード候補を抽出し、それぞれソート済みリストで返す。
+    """
+    # findall の中間リストを作らず、マッチを直接集合に入れる
+    katakana_keywords = sorted({m.group() for m in katakana_pattern.finditer(content)})
+    english_keywords = sorted({m.group() for m in english_pattern.finditer(content)})
+    return katakana_keywords, english_keywords
+
+def generate_keywords_for_file(job):
+    """
+    1ファイル分のトークン列を構文解析し、名詞を含む句の表層形をソート済みリストで返す。
+    multiprocessing.Pool のワーカーとして使うため (filename, tokens) を受け取り、
+    (filename, keywords) を返す。
+    """
+    filename, tokens = job
+    debug_this_file = False # デバッグ出力を見たい場合は True にする
     parser = ShiftReduceParser(debug_mode=debug_this_file)
-    file_counter += 1
 
     base_chunks = create_base_chunks(tokens)
     if debug_this_file:
@@ -340,137 +427,333 @@ for filename, tokens in all_tokens.items():
         for chunk in base_chunks:
             print(f"  Surface: '{chunk['surface']}', POS: '{chunk['pos']}'")
         print(f"--- End Base Chunks ---")
-    
-    # パーサーで構文解析を実行
-    final_stack = parser.parse(base_chunks)
 
-    # 最終スタック内のすべてのチャンクからキーワード候補を収集
-    for chunk in final_stack:
-        all_sub_chunks = parser._collect_chunks_from_tree(chunk)
-        for sub_chunk in all_sub_chunks:
-            # 意味のある句（NP, VP, ADJP）のみをキーワード候補とする
-            if sub_chunk.get('pos') in ['NP', 'VP', 'ADJP'] and len(sub_chunk['surface']) >= 3:
-                if parser._contains_noun(sub_chunk):
-                    generated_keywords_with_nouns.add(sub_chunk['surface'])
+    # パーサーで構文解析を実行し、途中で生成された句からキーワード候補を収集
+    file_keywords = set()
+    parser.parse(base_chunks, file_keywords)
+    return filename, sorted(file_keywords)
+
+def analyze_transcript(job):
+    """
+    キャッシュの使えないファイルについて、形態素解析・構文解析・カタカナ/英単語の抽出を1つのワーカーでまとめて行う。
+    トークン列を構文解析のために再びワーカーへ送らずに済む。
+    (filename, content) を受け取り、(filename, キャッシュ項目) を返す。
+    """
+    filename, content = job
+    _, tokens = tokenize_transcript(job)
+    _, generated_keywords = generate_keywords_for_file((filename, tokens))
+    katakana_keywords, english_keywords = extract_pattern_keywords(content)
+    return filename, {
+        'token_version': token_cache_version,
+        'tokens': tokens,
+        'parser_version': parser_cache_version,
+        'generated_keywords': generated_keywords,
+        'katakana_keywords': katakana_keywords,
+        'english_keywords': english_keywords
+    }
 
-print(f"Generated {len(generated_keywords_with_nouns)} unique keyword surfaces from tokens.")
 
-# 4. Combine all keyword sources
-all_keywords = json_keywords.union(katakana_keywords).union(english_keywords).union(generated_keywords_with_nouns)
-print(f"Total unique keyword candidates: {len(all_keywords)}")
+def main(pretty=False):
+    # Ensure output directory exists
+    os.makedirs(output_dir, exist_ok=True)
 
+    print("Loading transcripts...")
+    # Load transcripts, extract titles, and clean content
+    transcript_files = glob.glob(transcript_pattern)
+    transcripts_data = {}
+    # 読み込みはI/O待ちが主なのでスレッドで並行に行う (結果の順序は transcript_files のまま)
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        for filepath, text in executor.map(read_transcript_text, transcript_files):
+            if not text:
+                continue
 
-# --- Filtering and Mapping ---
-print("Filtering and mapping keywords...")
-start_time = time.time()
+            filename = os.path.basename(filepath)
+            # 1行目がタイトル、残りが本文 (行のリストや join を経由せずに切り分ける)
+            raw_title, _, body = text.partition('\n')
+            cleaned_title = raw_title.strip().split(' - ')[0]
+            content = body.strip()
 
-keyword_to_episodes = defaultdict(list)
-escaped_keywords = [re.escape(kw) for kw in all_keywords if kw]
+            transcripts_data[filename] = {
+                "title": cleaned_title,
+                "content": content,
+                "filepath": filepath
+            }
+    print(f"Loaded {len(transcripts_data)} transcripts.")
 
-# --- Regex Chunking ---
-chunk_size = 500  # Process 500 keywords at a time
-keyword_chunks = [escaped_keywords[i:i + chunk_size] for i in range(0, len(escaped_keywords), chunk_size)]
-regex_chunks = [re.compile('|'.join(chunk)) for chunk in keyword_chunks if chunk]
-# --------------------
+    # --- Tokenization with Caching ---
+    # キャッシュは今あるトランスクリプトの分だけ、使う時点で読み込む
+    # (削除されたエピソードのキャッシュは読まない)
+    cache_data = {}
+    all_tokens = {}
+    updated_cache_files = set()
+    files_to_tokenize = []
+    file_stamps = {}
+    legacy_cache = None
 
-if regex_chunks:
+    print("Tokenizing transcripts (using cache possible)...")
     for filename, data in transcripts_data.items():
-        content = data['content']
-        found_keywords_in_file = set()
-        for regex in regex_chunks:
-            found_keywords_in_file.update(regex.findall(content))
-        for keyword in found_keywords_in_file:
-            keyword_to_episodes[keyword].append(filename)
-else:
-    print("No keywords to map.")
-
-end_time = time.time()
-print(f"Finished mapping. Duration: {end_time - start_time:.2f} seconds")
-
-# --- New Filter Order ---
-
-# 1. --- Final Filtering by Episode Count (run first) ---
-total_episode_count = len(transcripts_data)
-print("Applying frequency filter...")
-frequent_keywords_map = {
-    keyword: episodes
-    for keyword, episodes in keyword_to_episodes.items()
-    if 2 < len(episodes) and (len(episodes) / total_episode_count) < 0.8
-}
-print(f"Keywords after frequency filter: {len(frequent_keywords_map)}")
-
-# 2. --- Post-processing: Remove substring keywords (run second on smaller set) ---
-print("Applying substring filter...")
-start_time_ss = time.time()
-
-keyword_set = set(frequent_keywords_map.keys())
-keywords_to_remove = set()
-similarity_threshold_episodes = total_episode_count * 0.04 
-
-sorted_keywords = sorted(list(keyword_set), key=len, reverse=True)
-
-for longer_keyword in sorted_keywords:
-    if longer_keyword in keywords_to_remove:
-        continue
-
-    substrings = {
-        longer_keyword[i:j] 
-        for i in range(len(longer_keyword)) 
-        for j in range(i, len(longer_keyword) + 1)
+        stat = os.stat(data['filepath'])
+        stamp = {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+        cached = load_cache_entry(filename)
+        if cached is None:
+            # シャードが無ければ以前のキャッシュから移行する (読み込みは最初の1回だけ)
+            if legacy_cache is None:
+                legacy_cache = load_legacy_cache()
+            if filename in legacy_cache:
+                cached = convert_legacy_cache_entry(legacy_cache[filename])
+        if cached is not None:
+            cache_data[filename] = cached
+        reusable = False
+        if cached and cached.get('token_version') == token_cache_version:
+            # mtime とサイズが同じなら内容も同じとみなし、違う場合だけ内容のハッシュで判定する
+            if cached.get('mtime') == stamp['mtime'] and cached.get('size', stamp['size']) == stamp['size']:
+                reusable = True
+            else:
+                reusable = cached.get('content_hash') == content_hash(data['content'])
+
+        if reusable:
+            all_tokens[filename] = cached['tokens']
+            if cached.get('mtime') != stamp['mtime'] or 'content_hash' not in cached:
+                # checkout や touch で mtime だけが変わった場合は、記録を更新して次回の再計算を避ける
+                cached.update(stamp, content_hash=content_hash(data['content']))
+                updated_cache_files.add(filename)
+        else:
+            print(f"  - Analyzing: {filename}")
+            files_to_tokenize.append(filename)
+            file_stamps[filename] = stamp
+
+    # 形態素解析はファイルごとに独立した重い処理なので、プロセスを分けて並列に行う。
+    # 同じワーカーで構文解析と抽出まで済ませるので、これらのファイルは後の段階では処理し直さない
+    analyze_jobs = [(filename, transcripts_data[filename]['content']) for filename in files_to_tokenize]
+    for filename, cache_entry in map_in_processes(analyze_transcript, analyze_jobs):
+        updated_cache_files.add(filename)
+        all_tokens[filename] = cache_entry['tokens']
+        cache_entry.update(file_stamps[filename], content_hash=content_hash(transcripts_data[filename]['content']))
+        cache_data[filename] = cache_entry
+
+    # 1. Load keywords from JSON file
+    json_keywords = set()
+    try:
+        with open(keywords_file, 'r', encoding='utf-8') as f:
+            keywords_data = json.load(f)
+            for item in keywords_data.get('keywords', []):
+                json_keywords.add(item.get('keyword', ''))
+        print(f"Loaded {len(json_keywords)} keywords from '{keywords_file}'.")
+    except (FileNotFoundError, json.JSONDecodeError):
+        print(f"Warning: Could not load or parse '{keywords_file}'. Continuing without it.")
+
+    # 2. Extract Katakana & English keywords
+    katakana_keywords = set()
+    english_keywords = set()
+    for filename, data in transcripts_data.items():
+        # 抽出結果はファイルごとにキャッシュし、内容が変わったファイルだけ走査し直す
+        cache_entry = cache_data[filename]
+        if cache_entry.get('parser_version') != parser_cache_version or 'katakana_keywords' not in cache_entry:
+            cache_entry['katakana_keywords'], cache_entry['english_keywords'] = extract_pattern_keywords(data['content'])
+            updated_cache_files.add(filename)
+        katakana_keywords.update(cache_entry['katakana_keywords'])
+        english_keywords.update(cache_entry['english_keywords'])
+    print(f"Extracted {len(katakana_keywords)} unique Katakana keywords.")
+    print(f"Extracted {len(english_keywords)} unique English keywords.")
+
+    # 3. Generate keywords from tokens using the new ShiftReduceParser
+    print("Generating keywords using Shift-Reduce Parser...")
+
+    generated_keywords_with_nouns = set()
+    files_to_parse = []
+
+    for filename in all_tokens:
+        cache_entry = cache_data[filename]
+        if cache_entry.get('parser_version') == parser_cache_version and 'generated_keywords' in cache_entry:
+            # トークンが変わっていなければ前回の構文解析結果をそのまま使う
+            generated_keywords_with_nouns.update(cache_entry['generated_keywords'])
+        else:
+            files_to_parse.append(filename)
+
+    # ファイルごとの解析は互いに独立しているので、CPUコア数分のプロセスで並列に行う
+    parse_jobs = [(filename, all_tokens[filename]) for filename in files_to_parse]
+    parse_results = map_in_processes(generate_keywords_for_file, parse_jobs)
+
+    for filename, file_keywords in parse_results:
+        generated_keywords_with_nouns.update(file_keywords)
+        cache_entry = cache_data[filename]
+        cache_entry['generated_keywords'] = file_keywords
+        cache_entry['parser_version'] = parser_cache_version
+        updated_cache_files.add(filename)
+
+    print(f"Generated {len(generated_keywords_with_nouns)} unique keyword surfaces from tokens.")
+
+    if updated_cache_files:
+        print(f"Saving {len(updated_cache_files)} cache entries to '{cache_dir}'...")
+        os.makedirs(cache_dir, exist_ok=True)
+        for filename in updated_cache_files:
+            save_cache_entry(filename, cache_data[filename])
+    if os.path.exists(legacy_cache_file):
+        print(f"Note: '{legacy_cache_file}' is no longer used (the cache now lives in '{cache_dir}/'). It can be deleted.")
+
+    # 4. Combine all keyword sources
+    all_keywords = json_keywords.union(katakana_keywords).union(english_keywords).union(generated_keywords_with_nouns)
+    print(f"Total unique keyword candidates: {len(all_keywords)}")
+
+    # 5. Drop noise candidates before mapping
+    all_keywords = {kw for kw in all_keywords if kw and not noise_keyword_pattern.fullmatch(kw)}
+    print(f"Keyword candidates after noise filter: {len(all_keywords)}")
+
+
+    # --- Filtering and Mapping ---
+    print("Filtering and mapping keywords...")
+    start_time = time.time()
+
+    # キーワードごとのエピソードのリストを先に用意しておき、照合結果を直接追加していく
+    # (ファイルごとにヒットの集合を作ってから辞書を引き直す手間を省く)。
+    # 一度も出現しなかったキーワードは空のリストのまま残り、次の頻度フィルタで除かれる
+    keyword_to_episodes = {kw: [] for kw in all_keywords if kw}
+
+    mapping_automaton = None
+    if ahocorasick is not None and keyword_to_episodes:
+        # --- Aho-Corasick: 全キーワードを1つのオートマトンで同時に照合する ---
+        # 値にはそのキーワードのエピソードのリストそのものを持たせる
+        mapping_automaton = ahocorasick.Automaton()
+        for kw, episodes in keyword_to_episodes.items():
+            mapping_automaton.add_word(kw, episodes)
+        mapping_automaton.make_automaton()
+
+    if keyword_to_episodes:
+        for filename, data in transcripts_data.items():
+            content = data['content']
+            if mapping_automaton is not None:
+                for _, episodes in mapping_automaton.iter(content):
+                    # 同じファイル内の2回目以降のヒットは末尾を見れば分かる
+                    if not episodes or episodes[-1] != filename:
+                        episodes.append(filename)
+            else:
+                # --- Literal search: キーワードはすべて単なる文字列なので、正規表現を使わず in で探す ---
+                for kw, episodes in keyword_to_episodes.items():
+                    if kw in content:
+                        episodes.append(filename)
+    else:
+        print("No keywords to map.")
+
+    end_time = time.time()
+    print(f"Finished mapping. Duration: {end_time - start_time:.2f} seconds")
+
+    # --- New Filter Order ---
+
+    # 1. --- Final Filtering by Episode Count (run first) ---
+    total_episode_count = len(transcripts_data)
+    print("Applying frequency filter...")
+    # 3エピソード以上、かつ全体の80%未満に出現するキーワードだけを残す (閾値は件数で事前計算)。
+    # 残るのは候補のごく一部なので、対応表を丸ごと複製せずに残すものだけで新しい辞書を作る
+    min_episode_count = 3
+    max_episode_count = total_episode_count * 0.8
+    frequent_keywords_map = {
+        keyword: episodes
+        for keyword, episodes in keyword_to_episodes.items()
+        if min_episode_count <= len(episodes) < max_episode_count
     }
-    substrings.discard(longer_keyword)
-    substrings.discard("")
+    print(f"Keywords after frequency filter: {len(frequent_keywords_map)}")
+
+    # 2. --- Post-processing: Remove substring keywords (run second on smaller set) ---
+    print("Applying substring filter...")
+    start_time_ss = time.time()
+
+    keyword_set = frequent_keywords_map.keys()
+    keywords_to_remove = set()
+    similarity_threshold_episodes = total_episode_count * 0.04 
+
+    sorted_keywords = sorted(keyword_set, key=len, reverse=True)
+
+    # pyahocorasick があれば全キーワードのオートマトンを一度だけ作り、
+    # 各キーワードに含まれる他のキーワードを1回の走査で列挙する
+    substring_automaton = None
+    if ahocorasick is not None and keyword_set:
+        substring_automaton = ahocorasick.Automaton()
+        for keyword in keyword_set:
+            substring_automaton.add_word(keyword, keyword)
+        substring_automaton.make_automaton()
+    else:
+        # 実在するキーワードの長さだけを調べれば、その他の長さの部分文字列は作らずに済む
+        present_lengths = sorted({len(keyword) for keyword in keyword_set})
 
-    for shorter_keyword in substrings:
-        if shorter_keyword in keywords_to_remove:
+    for longer_keyword in sorted_keywords:
+        if longer_keyword in keywords_to_remove:
             continue
+        longer_episode_count = len(frequent_keywords_map[longer_keyword])
+
+        if substring_automaton is not None:
+            # ヒットしたキーワードをそのまま順に調べ、部分文字列の集合は作らない
+            substrings = (keyword for _, keyword in substring_automaton.iter(longer_keyword))
+        else:
+            substrings = set()
+            for length in present_lengths:
+                if length >= len(longer_keyword):
+                    break
+                for i in range(len(longer_keyword) - length + 1):
+                    substring = longer_keyword[i:i + length]
+                    if substring in keyword_set:
+                        substrings.add(substring)
 
-        if shorter_keyword in keyword_set:
-            longer_episodes = frequent_keywords_map.get(longer_keyword, [])
-            shorter_episodes = frequent_keywords_map.get(shorter_keyword, [])
-            
+        for shorter_keyword in substrings:
+            if shorter_keyword == longer_keyword or shorter_keyword in keywords_to_remove:
+                continue
+
+            # keyword_set に含まれないもの (空文字列を含む) は None になる
+            shorter_episodes = frequent_keywords_map.get(shorter_keyword)
             if not shorter_episodes:
                 continue
 
-            if abs(len(longer_episodes) - len(shorter_episodes)) <= similarity_threshold_episodes:
+            if abs(longer_episode_count - len(shorter_episodes)) <= similarity_threshold_episodes:
                 keywords_to_remove.add(shorter_keyword)
 
-final_keywords_after_substring = keyword_set - keywords_to_remove
-end_time_ss = time.time()
-print(f"Finished substring filter. Duration: {end_time_ss - start_time_ss:.2f} seconds")
+    final_keywords_after_substring = keyword_set - keywords_to_remove
+    end_time_ss = time.time()
+    print(f"Finished substring filter. Duration: {end_time_ss - start_time_ss:.2f} seconds")
 
-# 3. --- Final Cleanup: Remove short, non-compound nouns ---
-final_keywords = final_keywords_after_substring
+    # 3. --- Final Cleanup: Remove short, non-compound nouns ---
+    final_keywords = final_keywords_after_substring
 
-print(f"Total keywords after all filters: {len(final_keywords)}")
+    print(f"Total keywords after all filters: {len(final_keywords)}")
 
-# --- Finalizing JSONs ---
-filtered_keyword_to_episodes = {
-    keyword: episodes
-    for keyword, episodes in frequent_keywords_map.items()
-    if keyword in final_keywords
-}
+    # --- Finalizing JSONs ---
+    # 出力の並び順は集合の走査順 (ハッシュシードで実行ごとに変わる) やファイルの列挙順に左右されないよう、
+    # キーワード・エピソードともにソートしておく (内容が同じなら出力ファイルも同じになる)。
+    # エピソードのリストは照合時に重複なく作ってある
+    filtered_keyword_to_episodes = {
+        keyword: sorted(frequent_keywords_map[keyword])
+        for keyword in sorted(final_keywords)
+    }
 
-valid_keywords = set(filtered_keyword_to_episodes.keys())
-episode_to_keywords = defaultdict(list)
-for filename, data in transcripts_data.items():
-    found_keywords = sorted([kw for kw in valid_keywords if kw in data['content']])
-    if found_keywords:
-        episode_to_keywords[filename] = found_keywords
-
-output_paths = {
-    'keyword_to_episodes.json': filtered_keyword_to_episodes,
-    'episode_to_keywords.json': episode_to_keywords,
-    'transcripts.json': {fn: {'title': d['title'], 'content': d['content']} for fn, d in transcripts_data.items()}
-}
+    # キーワード→エピソードの対応は計算済みなので、書き起こしを再走査せず逆引きで作る。
+    # キーワードをソート順に辿るので、エピソードごとのリストもソート済みになる
+    keywords_by_episode = defaultdict(list)
+    for keyword, episodes in filtered_keyword_to_episodes.items():
+        for filename in episodes:
+            keywords_by_episode[filename].append(keyword)
+    episode_to_keywords = {filename: keywords_by_episode[filename] for filename in sorted(keywords_by_episode)}
+
+    output_paths = {
+        'keyword_to_episodes.json': filtered_keyword_to_episodes,
+        'episode_to_keywords.json': episode_to_keywords,
+        'transcripts.json': {fn: {'title': d['title'], 'content': d['content']} for fn, d in transcripts_data.items()}
+    }
+
+    # --- Task 2: Save filtered json_keywords to a separate file ---
+    filtered_json_keywords = {kw for kw in json_keywords if kw in filtered_keyword_to_episodes}
+    output_paths['json_source_keywords.json'] = sorted(filtered_json_keywords)
+
+    # 出力はフロントエンドが読むだけなので、--pretty を指定しない限りインデントせずに書き出す
+    print(f"Writing {len(output_paths)} JSON files to '{output_dir}' directory...")
+    for filename, data in output_paths.items():
+        written = write_output_json(os.path.join(output_dir, filename), data, indent=pretty)
+        if not written:
+            print(f"  - Unchanged: {filename}")
 
-# --- Task 2: Save filtered json_keywords to a separate file ---
-filtered_json_keywords = {kw for kw in json_keywords if kw in filtered_keyword_to_episodes}
-output_paths['json_source_keywords.json'] = list(filtered_json_keywords)
+    print("Analysis complete. JSON files have been regenerated.")
 
-print(f"Writing {len(output_paths)} JSON files to '{output_dir}' directory...")
-for filename, data in output_paths.items():
-    with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
 
-print("Analysis complete. JSON files have been regenerated.")
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="ポッドキャストの文字起こしからキーワードを抽出し、docs/ 以下にJSONを生成する")
+    arg_parser.add_argument('--pretty', action='store_true', help="出力JSONをインデント付きで書き出す")
+    args = arg_parser.parse_args()
+    main(pretty=args.pretty)